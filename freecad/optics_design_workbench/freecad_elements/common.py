@@ -14,27 +14,52 @@ import time
 
 from .. import simulation
 
+try:
+  from ..detect_pyside import QApplication
+except ImportError:
+  QApplication = None
+
+_HAS_GUI = None
 _LAST_PROCESS_EVENTS_CALL = time.time()
 _MIN_UPDATE_INTERVAL = 1e-2
+_LAST_STATUS_CHECK = time.time()
+_MIN_STATUS_CHECK_INTERVAL = 1e-1
 
 class SimulationEnded(RuntimeError):
   pass
 
+def hasGui():
+  '''
+  Return True if this process runs a QApplication. The result is cached: the
+  FreeCAD GUI creates its application long before any of this code runs and
+  headless FreeCAD never creates one.
+  '''
+  global _HAS_GUI
+  if _HAS_GUI is None:
+    _HAS_GUI = QApplication is not None and QApplication.instance() is not None
+  return _HAS_GUI
+
 def keepGuiResponsive(raiseIfSimulationDone=False):
-  from ..detect_pyside import QApplication  
-  global _LAST_PROCESS_EVENTS_CALL
+  global _LAST_PROCESS_EVENTS_CALL, _LAST_STATUS_CHECK
   if time.time()-_LAST_PROCESS_EVENTS_CALL > _MIN_UPDATE_INTERVAL:
     _LAST_PROCESS_EVENTS_CALL = time.time()
   
-    if QApplication.instance():
+    if hasGui():
       # process Qt events
       QApplication.processEvents()
       Gui.updateGui()
       QApplication.processEvents()
 
-    # check whether simulation was canceled and raise SimulationEnded if so
-    if raiseIfSimulationDone and (simulation.isCanceled() or simulation.isFinished()):
-      raise SimulationEnded()
+    # check whether master asked us to quit or simulation was canceled/finished
+    # and raise SimulationEnded if so
+    if raiseIfSimulationDone:
+      simulation.raiseIfQuitRequested()
+
+      # status files may live on slow network storage, check them less often
+      if time.time()-_LAST_STATUS_CHECK > _MIN_STATUS_CHECK_INTERVAL:
+        _LAST_STATUS_CHECK = time.time()
+        if simulation.isCanceled() or simulation.isFinished():
+          raise SimulationEnded()
       
 def keepGuiResponsiveAndRaiseIfSimulationDone():
   keepGuiResponsive(raiseIfSimulationDone=True)
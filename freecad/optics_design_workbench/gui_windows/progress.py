@@ -50,7 +50,15 @@ class QLabeledProgress(QProgressBar):
     self.lastVal = None
 
   def setValue(self, val):
+    # the progress window polls much more often than the values change,
+    # skip reformatting the bar if nothing but the time estimate changed
+    unchanged = (val == self.lastVal)
     self.lastVal = val
+    if isfinite(self.maximum) and time.time()-self.t0 > 5 and val > 0:
+      self.remainingSeconds = (time.time()-self.t0)/val * max([self.maximum-val, 0])
+    if unchanged:
+      return
+
     scale, suff = scaleSuff(val)
 
     # decide out how many digits to show
@@ -62,8 +70,6 @@ class QLabeledProgress(QProgressBar):
 
     # show progress including target value
     if isfinite(self.maximum):
-      if time.time()-self.t0 > 5 and val > 0:
-        self.remainingSeconds = (time.time()-self.t0)/val * max([self.maximum-val, 0])
       self.setRange(0, max([val+1e-2, self.maximum]))
       mscale, msuff = scaleSuff(self.maximum)
       # decide how many digits to show for maximum
@@ -122,10 +128,13 @@ class ProgressWindow(QWidget):
     self.hitsRecorded.maximum = store.endAfterHits
     self.iterations.t0 = time.time()
     self.iterations.remainingSeconds = None
+    self.iterations.lastVal = None
     self.raysTraced.t0 = time.time()
     self.raysTraced.remainingSeconds = None
+    self.raysTraced.lastVal = None
     self.hitsRecorded.t0 = time.time()
     self.hitsRecorded.remainingSeconds = None
+    self.hitsRecorded.lastVal = None
     self.timer.start(50)
 
   def onTimer(self):
@@ -7,7 +7,7 @@ __url__ = 'https://github.com/zaphB/freecad.optics_design_workbench'
 import logging
 import logging.handlers as handlers
 import os
-import datetime
+import time
 import random
 import warnings
 
@@ -100,32 +100,37 @@ def gatherSlaveFiles():
   if not _IS_INIT or not processes.isMasterProcess():
     return
 
-  for f in os.listdir(_LOG_DIR):
-    # check if file looks like a slave's log
-    if f.startswith('optics_design_workbench.pid') and f.endswith('.log'):
-      pid = None
-      try:
-        pid = int(f[27:-4])
-      except ValueError:
-        pass
-      if pid:
-
-        # rename file to prevent new lines being written while we parse it
-        # the slave process will recreate its own logfile if new messages appear
-        while True:
-          tmpName = f'{_LOG_DIR}/{int(random.random()*1e12)}.log'
-          if not os.path.exists(tmpName):
-            break
-        os.rename(_LOG_DIR+'/'+f, tmpName)
-
-        # append file to main log
-        with open(tmpName, 'r') as inFile:
-          with open(_LOG_DIR+'/'+_LOGFILE_NAME, 'a') as outFile:
+  # open main log once for all slave logs
+  with open(_LOG_DIR+'/'+_LOGFILE_NAME, 'a') as outFile:
+    for f in os.listdir(_LOG_DIR):
+      # check if file looks like a slave's log
+      if f.startswith('optics_design_workbench.pid') and f.endswith('.log'):
+        pid = None
+        try:
+          pid = int(f[27:-4])
+        except ValueError:
+          pass
+        if pid:
+
+          # rename file to prevent new lines being written while we parse it
+          # the slave process will recreate its own logfile if new messages appear
+          while True:
+            tmpName = f'{_LOG_DIR}/{int(random.random()*1e12)}.log'
+            if not os.path.exists(tmpName):
+              break
+          os.rename(_LOG_DIR+'/'+f, tmpName)
+
+          # append file to main log, lines need the slave pid inserted after the
+          # timestamp so they cannot be copied verbatim
+          with open(tmpName, 'r') as inFile:
+            lines = []
             for line in inFile:
-              outFile.write(f'{" ".join(line.split()[:2])} (slave {pid}) {" ".join(line.split()[2:])}\n')
-        
-        # remove tempfile
-        os.remove(tmpName) 
+              words = line.split()
+              lines.append(f'{" ".join(words[:2])} (slave {pid}) {" ".join(words[2:])}\n')
+            outFile.write(''.join(lines))
+          
+          # remove tempfile
+          os.remove(tmpName) 
 
 def _indentMsg(msg):
   ls = [l for l in '\n'.join([str(l) for l in msg]).split('\n') if l.strip()]
@@ -139,7 +144,9 @@ def _indentMsg(msg):
     return ('\n'+' '*2+'| ').join(ls[:-1])+'\n'+' '*2+r'\ '+ls[-1]
 
 def _prefix(kind=''):
-  prefix = datetime.datetime.now().strftime('[Optics Design %H:%M:%S.%f] ')
+  now = time.time()
+  prefix = (time.strftime('[Optics Design %H:%M:%S', time.localtime(now))
+            + f'.{int(now%1*1e6):06d}] ')
   if kind:
     prefix += kind.upper()+': '
   return prefix
@@ -24,7 +24,11 @@ def makeGoodRandomSeed():
   import threading
   import time
 
-  seed = int(str(threading.get_ident())+str(os.getpid())+str(int(1e7*time.time()))[-10:]) % (2**32)
+  # prefer kernel entropy, fall back to mixing thread id, pid and time
+  try:
+    seed = int.from_bytes(os.urandom(4), 'little')
+  except NotImplementedError:
+    seed = int(str(threading.get_ident())+str(os.getpid())+str(int(1e7*time.time()))[-10:]) % (2**32)
   random.seed(seed)
   numpy.random.seed(seed)
 
@@ -25,16 +25,18 @@ try:
 except ImportError:
   pass
 
-from numpy import *
+from math import inf
 import time
 import datetime
 import functools
-import subprocess
 import os
+import re
 import sys
 import threading
 import signal
+import select
 import itertools
+import glob
 
 from ...detect_pyside import *
 from ... import freecad_elements
@@ -47,6 +49,13 @@ _IS_MASTER_PROCESS = None
 _SIMULATING_DOCUMENT = None
 _BACKGROUND_PROCESSES = []
 _ASSUME_DEAD_TIMEOUT = 15
+_CONTROL_FD = None
+_CONTROL_STATE = None
+_SIGTERM_RECEIVED = False
+_RESULTS_FOLDER_PATH = None
+_STATUS_CACHE = {}
+_STATUS_TTL = 5e-2
+_CPUINFO_ID_REGEX = re.compile(r'^(processor|physical id|core id)\s*:\s*(\d+)', re.MULTILINE)
 
 # process info
 def isMasterProcess():
@@ -54,8 +63,157 @@ def isMasterProcess():
 
 def isWorkerRunning():
   #print(isCanceled(), [w.isRunning() for w in _BACKGROUND_PROCESSES])
-  _BACKGROUND_PROCESSES[:] = [w for w in _BACKGROUND_PROCESSES if w.isRunning()]
-  return len(_BACKGROUND_PROCESSES)
+  # may be called from any thread (e.g. via cancelSimulation), only count the
+  # workers that are alive and leave reaping to the master's main thread
+  return len([w for w in list(_BACKGROUND_PROCESSES) if w.isRunning()])
+
+def _reapWorkers():
+  '''
+  Remove exited workers from the list of background processes, release their
+  control pipes and pidfds and return the number of workers still running. 
+  Must only be called from the main thread of the master process, which is the
+  only one waiting on the pidfds.
+  '''
+  # a single select on all pidfds tells which workers exited, only those need
+  # to be polled (right away, bypassing the cached poll result), fall back to
+  # polling all workers if pidfds are not available
+  exited = None
+  pidfds = [w.pidfd for w in _BACKGROUND_PROCESSES if w.pidfd is not None]
+  if pidfds and len(pidfds) == len(_BACKGROUND_PROCESSES):
+    exited = set(select.select(pidfds, [], [], 0)[0])
+  running = []
+  for w in _BACKGROUND_PROCESSES:
+    if (exited is not None and w.pidfd not in exited) or w.isRunning(maxAge=0 if exited is not None else None):
+      running.append(w)
+    else:
+      w.release()
+  _BACKGROUND_PROCESSES[:] = running
+  return len(running)
+
+def _quitWorkers():
+  # ask workers to quit right away, they will see the status files as well
+  # but the control pipe is noticed sooner (master's main thread only)
+  for w in _BACKGROUND_PROCESSES:
+    w.quit()
+
+def _pollControlPipe():
+  '''
+  Read pending messages from the control pipe connected to the master process
+  (workers only). Returns 'quit' if the master asked us to quit, 'orphaned' if
+  the master closed its end or died, None otherwise.
+  '''
+  global _CONTROL_STATE
+  if _CONTROL_FD is not None and _CONTROL_STATE is None:
+    try:
+      data = os.read(_CONTROL_FD, 64)
+    except BlockingIOError:
+      pass
+    else:
+      _CONTROL_STATE = 'quit' if data else 'orphaned'
+  return _CONTROL_STATE
+
+def raiseIfQuitRequested():
+  if (state := _pollControlPipe()) == 'quit':
+    raise freecad_elements.SimulationEnded()
+  elif state == 'orphaned':
+    raise RuntimeError('control pipe of master process was closed, it seems to have died, '
+                       'exiting as well...')
+  elif _SIGTERM_RECEIVED:
+    raise freecad_elements.SimulationEnded()
+
+def _setupParentDeathSignal():
+  '''
+  Ask the kernel to send SIGTERM to this worker if its parent dies (linux only)
+  and make SIGTERM end the simulation such that the cleanup in runSimulation
+  still runs. The handler only sets a flag, raising from it could end up in 
+  any try/except block or interrupt the final flush, raiseIfQuitRequested 
+  raises at the next safe point instead.
+  '''
+  def onSigterm(signum, frame):
+    global _SIGTERM_RECEIVED
+    _SIGTERM_RECEIVED = True
+
+  try:
+    signal.signal(signal.SIGTERM, onSigterm)
+  except ValueError:
+    # signal handlers can only be installed from the main thread
+    return
+
+  if sys.platform.startswith('linux'):
+    try:
+      import ctypes
+      PR_SET_PDEATHSIG = 1
+      ctypes.CDLL('libc.so.6', use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM, 0, 0, 0)
+    except Exception:
+      pass
+
+def _isDocumentModified(doc):
+  # only the gui document knows whether there are unsaved changes, assume
+  # there are some if we cannot tell
+  try:
+    return Gui.getDocument(doc.Name).Modified
+  except Exception:
+    return True
+
+def _waitForWorkers(timeout):
+  '''
+  Block until one of the worker processes exits or timeout seconds have passed.
+  Falls back to plain sleeping if pidfds are not supported.
+  '''
+  pidfds = [w.pidfd for w in _BACKGROUND_PROCESSES if w.pidfd is not None]
+  if pidfds and len(pidfds) == len(_BACKGROUND_PROCESSES):
+    select.select(pidfds, [], [], timeout)
+  else:
+    time.sleep(timeout)
+
+def _runWorkerEventLoop():
+  '''
+  Run a nested Qt event loop until all worker processes exited. Worker exits
+  are noticed via socket notifiers on their pidfds, a timer checks as well 
+  for workers without pidfd. Workers are not reaped here, their pidfds must 
+  stay open as long as the notifiers exist.
+  '''
+  loop = QEventLoop()
+  notifiers = []
+
+  def checkWorkers():
+    # pidfds of exited workers stay readable, disable their notifiers before
+    # control returns to the event loop
+    for w, n in notifiers:
+      if n.isEnabled() and not w.isRunning(maxAge=0):
+        n.setEnabled(False)
+    if not isWorkerRunning():
+      loop.quit()
+
+  for w in _BACKGROUND_PROCESSES:
+    if w.pidfd is not None:
+      notifiers.append((w, QSocketNotifier(w.pidfd, QSocketNotifier.Type.Read)))
+      notifiers[-1][1].activated.connect(checkWorkers)
+  checkTimer = QTimer()
+  checkTimer.timeout.connect(checkWorkers)
+  checkTimer.start(1000 if len(notifiers) == len(_BACKGROUND_PROCESSES) else 100)
+  (loop.exec if hasattr(loop, 'exec') else loop.exec_)()
+  checkTimer.stop()
+  for _, n in notifiers:
+    n.setEnabled(False)
+
+  # reaping closes the pidfds, drop the notifiers first
+  notifiers.clear()
+  _reapWorkers()
+
+def _workerWaitTimeout():
+  # short timeouts if the gui needs to be kept responsive, long otherwise
+  return 1e-2 if freecad_elements.hasGui() else .3
+
+def _parseLimit(x):
+  # end criteria are stored as strings in the settings, 'inf' means no limit,
+  # plain integers are most common, others like '1e6' go through float
+  if x == 'inf':
+    return inf
+  try:
+    return int(x)
+  except ValueError:
+    return int(round(float(x)))
 
 def simulatingDocument():
   if _SIMULATING_DOCUMENT is not None:
@@ -64,20 +222,40 @@ def simulatingDocument():
 
 # status file info/manipulation
 def _statusFilePath(name):
-  return f'{results_store.getResultsFolderPath()}/{name}'
+  # resolving the results folder walks the document to find the active settings,
+  # use the path fixed at simulation start if a simulation runs in this process
+  folder = _RESULTS_FOLDER_PATH or results_store.getResultsFolderPath()
+  return f'{folder}/{name}'
 
 def _queryStatus(name):
-  return os.path.exists(_statusFilePath(name))
+  # status changes are rare but queried in bursts (isRunning calls isCanceled,
+  # gui and progress timers ask again...), reuse results younger than _STATUS_TTL
+  path = _statusFilePath(name)
+  now = time.monotonic()
+  if (cached := _STATUS_CACHE.get(path)) and now-cached[0] < _STATUS_TTL:
+    return cached[1]
+  status = os.path.exists(path)
+  _STATUS_CACHE[path] = (now, status)
+  return status
 
 def _setStatus(name, status):
+  # create empty flag file or remove it, creating the folder only if it is 
+  # missing and ignoring files that already are in the desired state
   path = _statusFilePath(name)
-  currentStatus = _queryStatus(name)
-  if status and not currentStatus:    
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w') as _:
+  _STATUS_CACHE.pop(path, None)
+  if status:
+    flags = os.O_CREAT | os.O_WRONLY | getattr(os, 'O_CLOEXEC', 0)
+    try:
+      fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      fd = os.open(path, flags, 0o644)
+    os.close(fd)
+  else:
+    try:
+      os.unlink(path)
+    except FileNotFoundError:
       pass
-  elif not status and currentStatus:
-    os.remove(path)
 
 def isRunning():
   # if is-running file does not exist, case is closed
@@ -110,29 +288,33 @@ def setIsRunning(state):
   return _setStatus('simulation-is-running', state)
 
 def isCanceled():
-  if status := _queryStatus('simulation-is-canceled'):
+  return _queryStatus('simulation-is-canceled')
+
+def setIsCanceled(state):
+  # canceled and finished are mutually exclusive
+  if state:
     try:
       setIsFinished(False)
     except Exception:
       pass
-  return status
-
-def setIsCanceled(state):
   _setStatus('simulation-is-canceled', state)
 
 def cancelSimulation():
+  # this may be called from any thread, only set the flag, the master's
+  # mainloop notices it and asks the workers to quit
   if isRunning():
     setIsCanceled(True)
 
 def isFinished():
-  if status := _queryStatus('simulation-is-done'):
+  return _queryStatus('simulation-is-done')
+
+def setIsFinished(state):
+  # canceled and finished are mutually exclusive
+  if state:
     try:
       setIsCanceled(False)
     except Exception:
       pass
-  return status
-
-def setIsFinished(state):
   _setStatus('simulation-is-done', state)
 
 
@@ -165,8 +347,12 @@ def runSimulation(action, slaveInfo={}):
              from calling master process if called in a worker process
   '''
   # set global variable to mark whether we are slave or master
-  global _IS_MASTER_PROCESS, _SIMULATING_DOCUMENT
+  global _IS_MASTER_PROCESS, _SIMULATING_DOCUMENT, _CONTROL_FD, _CONTROL_STATE, _SIGTERM_RECEIVED, _RESULTS_FOLDER_PATH
   _IS_MASTER_PROCESS = not bool(slaveInfo)
+  _CONTROL_STATE = None
+  _SIGTERM_RECEIVED = False
+  if (_CONTROL_FD := slaveInfo.get('controlFd', None)) is not None:
+    os.set_blocking(_CONTROL_FD, False)
   t0 = time.time()
 
   # setup random seeds to ensure good randomness across all workers and threads
@@ -179,6 +365,10 @@ def runSimulation(action, slaveInfo={}):
     # prepare simulation, assemble simulation parameters from the various sources (settings,
     # defaults, mutual conditions, ...)
 
+    # resolve results folder once, status files are queried very often and the
+    # folder must not change during the run (e.g. date in the folder pattern)
+    _RESULTS_FOLDER_PATH = results_store.getResultsFolderPath()
+
     # make sure other simulations have stopped and no other simulation
     # can be started
     if isMasterProcess():
@@ -192,11 +382,19 @@ def runSimulation(action, slaveInfo={}):
     else:
       if not isRunning():
         raise RuntimeError('slave was launched but no simulation seems to be running')
+      _setupParentDeathSignal()
         
-    # recompute and save document
+    # recompute and save document, workers load the saved file so the master needs to
+    # save unsaved changes before launching them, workers load the recomputed state
+    # and neither need to recompute nor to save
     _SIMULATING_DOCUMENT = App.activeDocument()
-    _SIMULATING_DOCUMENT.recompute()
-    _SIMULATING_DOCUMENT.save()
+    if isMasterProcess():
+      _SIMULATING_DOCUMENT.recompute()
+      if _isDocumentModified(_SIMULATING_DOCUMENT):
+        _SIMULATING_DOCUMENT.save()
+
+    # fetch active settings once, looking them up walks the whole document
+    settings = freecad_elements.find.activeSimulationSettings()
 
     # determine simulation mode
     mode = action
@@ -210,7 +408,7 @@ def runSimulation(action, slaveInfo={}):
     # determine whether to store results or not
     store = False
     storeSingleShot = False
-    if settings := freecad_elements.find.activeSimulationSettings():
+    if settings:
       storeSingleShot = settings.EnableStoreSingleShotData
     if action in ('singlepseudo', 'singletrue', 'fans'):
       store = storeSingleShot
@@ -220,7 +418,7 @@ def runSimulation(action, slaveInfo={}):
     # determine whether to draw rays or not
     draw = True
     drawContinuous = False
-    if settings := freecad_elements.find.activeSimulationSettings():
+    if settings:
       drawContinuous = settings.ShowRaysInContinuousMode
     if action in ('pseudo', 'true'):
       draw = drawContinuous
@@ -230,9 +428,10 @@ def runSimulation(action, slaveInfo={}):
       draw = False
 
     # determine number if workers to spawn (single for single shot simulations, 
-    # according to settings for more than one iteration)
+    # according to settings for more than one iteration), only the master spawns
+    # workers, so workers do not need to inspect the cpu topology
     workers = 1
-    if continuous and (settings := freecad_elements.find.activeSimulationSettings()):
+    if continuous and settings and isMasterProcess():
       if settings.WorkerProcessCount == 'num_cpus':
         workers = cpuCount()
       else:
@@ -242,11 +441,10 @@ def runSimulation(action, slaveInfo={}):
     endAfterIterations = 10
     endAfterRays = inf
     endAfterHits = inf
-    if settings := freecad_elements.find.activeSimulationSettings():
-      _parse = lambda x: int(round(float(x))) if x!='inf' else inf
-      endAfterIterations = _parse(settings.EndAfterIterations)
-      endAfterRays = _parse(settings.EndAfterRays)
-      endAfterHits = _parse(settings.EndAfterHits)
+    if settings:
+      endAfterIterations = _parseLimit(settings.EndAfterIterations)
+      endAfterRays = _parseLimit(settings.EndAfterRays)
+      endAfterHits = _parseLimit(settings.EndAfterHits)
 
     # generate simulation run folder name
     simulationRunFolder = slaveInfo.get('simulationRunFolder', 
@@ -266,11 +464,15 @@ def runSimulation(action, slaveInfo={}):
     # do pre-worker launched init and post-worker launched init of each light source
     # and optical object
 
+    # light sources and optical objects do not change during a simulation, look
+    # them up only once, each lookup walks the whole document
+    lightSources = list(freecad_elements.find.lightSources())
+    opticalObjects = list(freecad_elements.find.relevantOpticalObjects())
+
     # run pre-worker-launch init
     if isMasterProcess():
       io.verb(f'doing pre-worker-lauch init of all components...')
-      for obj in itertools.chain(freecad_elements.find.lightSources(), 
-                                 freecad_elements.find.relevantOpticalObjects()):
+      for obj in itertools.chain(lightSources, opticalObjects):
         obj.Proxy.onInitializeSimulation(obj=obj, state='pre-worker-launch', ident='master')
 
     # launch background worker processes (one less than specified if draw is true because 
@@ -284,14 +486,17 @@ def runSimulation(action, slaveInfo={}):
         io.info(f'doing simulation work with {backgroundWorkers} background workers and lazy gui process')
       for workerNo in range(backgroundWorkers):
         _BACKGROUND_PROCESSES.append(worker_process.WorkerProcess(simulationType=mode, simulationRunFolder=simulationRunFolder))
-        for _ in range(50):
-          freecad_elements.keepGuiResponsiveAndRaiseIfSimulationDone()
-          time.sleep(.01)
+
+        # if the master traces rays as well, keep the workers off one physical
+        # core such that they do not compete with the master, the scheduler 
+        # distributes the workers (and their threads) among the remaining cpus
+        if draw and (cpus := _workerCpus()):
+          _BACKGROUND_PROCESSES[-1].setCpuAffinity(cpus)
+        freecad_elements.keepGuiResponsiveAndRaiseIfSimulationDone()
 
     # doing post-worker-launch init
     io.verb(f'doing post-worker-lauch init of all components...')
-    for obj in itertools.chain(freecad_elements.find.lightSources(), 
-                                freecad_elements.find.relevantOpticalObjects()):
+    for obj in itertools.chain(lightSources, opticalObjects):
       obj.Proxy.onInitializeSimulation(obj=obj, state='post-worker-launch', ident='master' if isMasterProcess() else 'worker')
 
     # report to shell that simulation starts
@@ -305,29 +510,29 @@ def runSimulation(action, slaveInfo={}):
       if isMasterProcess():
         io.verb(f'gui process is not lazy and runs the simulation mainloop')
       
+      # make sure simulation is canceled if not light source exists
+      if not lightSources:
+        io.err(f'no light source exists in current project, cannot trace any rays.')
+        raise freecad_elements.SimulationEnded()
+
+      lastProgressCheck = -inf
       while True:
         # do ray-tracing for all light sources
-        lightSourceExists = False
-        for obj in freecad_elements.find.lightSources():
-          lightSourceExists = True
+        for obj in lightSources:
 
           # run iteration for the light source
           obj.Proxy.runSimulationIteration(obj=obj, mode=mode, draw=draw, store=store)
 
-          # raise simulation canceled exception if parent PID is not alive
-          if not isMasterProcess():
-            try:
-              os.kill(slaveInfo['parentPid'], 0)
-            except OSError:
-              raise RuntimeError(f'parent pid {slaveInfo["parentPid"]} seems to have died, exiting as well...')
-
           # handle GUI events and raise if simulation is done
           freecad_elements.keepGuiResponsiveAndRaiseIfSimulationDone()
-        
-        # make sure simulation is canceled if not light source exists
-        if not lightSourceExists:
-          io.err(f'no light source exists in current project, cannot trace any rays.')
-          raise freecad_elements.SimulationEnded()
+
+        # raise simulation canceled exception if parent PID is not alive, only needed
+        # without control pipe, otherwise the pipe reports the death of the master
+        if not isMasterProcess() and _CONTROL_FD is None:
+          try:
+            os.kill(slaveInfo['parentPid'], 0)
+          except OSError:
+            raise RuntimeError(f'parent pid {slaveInfo["parentPid"]} seems to have died, exiting as well...')
 
         if store:
           # tell storage object that iteration is done
@@ -337,10 +542,13 @@ def runSimulation(action, slaveInfo={}):
           # to disk in the rare case of no .addRay or .addRayHit calls at all during simulation)
           store.writeDiskIfNeeded()
 
-          if isMasterProcess():
+          if isMasterProcess() and time.monotonic()-lastProgressCheck > store.dumpProgressEverySeconds:
             # make sure progress is updated in master process (this will also trigger 
-            # place finished file if one of the specified end criteria is reached)
+            # place finished file if one of the specified end criteria is reached),
+            # progress files change only every few hundred ms, so reading them
+            # more often than they are dumped is wasted effort
             store.getProgress()
+            lastProgressCheck = time.monotonic()
 
         # end mainloop after first iteration if not in continuous (=singleshot) mode      
         if not continuous:
@@ -351,8 +559,10 @@ def runSimulation(action, slaveInfo={}):
     #             poll progress instead, do not use a loop, but a QTimer for 
     io.verb(f'gui process is lazy and just tracks progress')
 
-    timer = QTimer()
     def updateProgress():
+      '''
+      Update progress and return True once the simulation is done or canceled.
+      '''
       if store and isMasterProcess():
         # make sure progress is updated (this will also place cancel/done files if one 
         # of the specified end criteria is reached)
@@ -361,21 +571,34 @@ def runSimulation(action, slaveInfo={}):
       # stop if canceled or done
       if isFinished():
         io.verb('simulation is done, exiting mainloop...')
-        timer.stop()
+        _quitWorkers()
+        return True
 
       # stop if run was canceled
       if isCanceled():
         io.info('simulation is canceled, exiting mainloop...')
-        timer.stop()
-
-    timer.timeout.connect(updateProgress)
-    timer.start(300)
+        _quitWorkers()
+        return True
+      return False
 
-    # this busy-loop makes the timer useless, but it is needed because cleanup is done
-    # in the finally block. Maybe restructure this in the future to improve performance
-    while isWorkerRunning():
-      time.sleep(1e-2)
-      freecad_elements.keepGuiResponsive()
+    # block until all workers exited because cleanup is done in the finally block, 
+    # with gui let a nested Qt event loop do the waiting such that the timer, 
+    # worker exits and gui events are handled as they come, without gui there
+    # is no event loop to run, wait on the workers directly and update progress
+    # in between
+    if isWorkerRunning():
+      if freecad_elements.hasGui():
+        timer = QTimer()
+        timer.timeout.connect(lambda: updateProgress() and timer.stop())
+        timer.start(300)
+        _runWorkerEventLoop()
+        timer.stop()
+      else:
+        done = False
+        while _reapWorkers():
+          _waitForWorkers(_workerWaitTimeout())
+          if not done:
+            done = updateProgress()
 
   ##########################################################################################
   # SimulationEnded exception is silently ignored
@@ -400,34 +623,40 @@ def runSimulation(action, slaveInfo={}):
       if not isCanceled():
         setIsFinished(True)
 
-      # wait for workers to finish
-      _t0 = time.time()
-      lastPrint = time.time()
-      while isWorkerRunning():
+      # ask workers to quit right away
+      _quitWorkers()
+
+      # wait for workers to finish, use one monotonic timestamp per pass such 
+      # that all workers see the same stage and clock jumps do not matter
+      _t0 = time.monotonic()
+      lastPrint = _t0
+      while _reapWorkers():
 
-        # keep GUI repsonsive and limit loop speed
-        time.sleep(1e-2)
+        # keep GUI repsonsive and wait for workers to exit
+        _waitForWorkers(_workerWaitTimeout())
         freecad_elements.keepGuiResponsive()
+        now = time.monotonic()
 
         # quit/kill worker processes if they take too long
-        if time.time()-_t0 > 3:
+        if now-_t0 > 3:
           for w in _BACKGROUND_PROCESSES:
-            if time.time()-_t0 < 7:
+            if now-_t0 < 7:
               w.quit()
-            elif time.time()-_t0 < 10:
+            elif now-_t0 < 10:
               w.terminate()
             else:
               w.kill()
 
         # report progress
-        if time.time()-lastPrint > 3:
+        if now-lastPrint > 3:
           io.info(f'waiting for {len(_BACKGROUND_PROCESSES)} worker processes to finish...')
-          lastPrint = time.time()
+          lastPrint = now
 
       # make sure all logfiles of worker processes are collected and merged into main log
       io.gatherSlaveFiles()
 
-      # run simulation exit hooks
+      # run simulation exit hooks, look up the objects again because the document
+      # may have been edited while the simulation was running
       io.verb(f'running simulation-exit hook of all components...')
       for obj in itertools.chain(freecad_elements.find.lightSources(), 
                                  freecad_elements.find.relevantOpticalObjects()):
@@ -442,35 +671,65 @@ def runSimulation(action, slaveInfo={}):
       # report success
       performanceDescription = ''
       if store and hasattr(store, 'performanceDescription'):
-        performanceDescription = f' ({store.performanceDescription()})'
+        # read the final progress dumps of all workers
+        performanceDescription = f' ({store.performanceDescription(maxAge=0)})'
       io.info(f'simulation {"ended gracefully" if not isCanceled() else "was canceled"} '
               f'after {time.time()-t0:.1e}s{performanceDescription}')
 
+    # status files of later runs may live elsewhere
+    _RESULTS_FOLDER_PATH = None
+
+
+@functools.cache
+def _cpuCores():
+  '''
+  Return dict mapping logical cpu numbers to (physical id, core id) tuples as
+  listed in the sysfs cpu topology or in /proc/cpuinfo, or an empty dict if 
+  neither is available.
+  '''
+  # sysfs topology is available on all linux architectures
+  cores = {}
+  for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology'):
+    try:
+      with open(f'{path}/physical_package_id', 'r') as f:
+        physicalId = f.read().strip()
+      with open(f'{path}/core_id', 'r') as f:
+        coreId = f.read().strip()
+    except OSError:
+      continue
+    cores[int(os.path.basename(os.path.dirname(path))[3:])] = (physicalId, coreId)
+  if cores:
+    return cores
+
+  # /proc/cpuinfo lists the ids on x86 only
+  try:
+    with open('/proc/cpuinfo', 'r') as f:
+      for block in f.read().split('\n\n'):
+        ids = dict(_CPUINFO_ID_REGEX.findall(block))
+        if 'processor' in ids and 'physical id' in ids and 'core id' in ids:
+          cores[int(ids['processor'])] = (ids['physical id'], ids['core id'])
+  except OSError:
+    pass
+  return cores
 
 @functools.cache
 def cpuCount():
   '''
-  Get number of physical cpus on this machine. Tries to parse lscpu output
-  and falls back to os module functions if that fails. 
+  Get number of physical cpus on this machine. Asks psutil if installed, then
+  tries to count the distinct cores listed in sysfs or /proc/cpuinfo and falls
+  back to os module functions if that fails.
   '''
-  # try analyze lscpu output
-  threadsPerCore = None
-  coresPerSocket = None
-  sockets = None
+  # psutil knows best if it is there
   try:
-    for l in subprocess.run('lscpu', check=False, capture_output=True, text=True).stdout.split('\n'):
-      if 'thread' in l.lower() and 'per core' in l.lower():
-        threadsPerCore = int(l.split(':')[-1].strip())
-      elif 'core' in l.lower() and 'per sock' in l.lower():
-        coresPerSocket = int(l.split(':')[-1].strip())
-      elif 'socket' in l.lower():
-        sockets = int(l.split(':')[-1].strip())
-  except Exception:
+    import psutil
+    if count := psutil.cpu_count(logical=False):
+      return count
+  except ImportError:
     pass
 
-  # return number of physical cores
-  if threadsPerCore and coresPerSocket and sockets:
-    return coresPerSocket * sockets
+  # count unique (physical id, core id) pairs of all processors
+  if cores := _cpuCores():
+    return len(set(cores.values()))
 
   # alternatively just use standard python modules for cpu count 
   # and divide result by two because virtually all cpus use two
@@ -482,11 +741,34 @@ def cpuCount():
   return max([1, count//2])
 
 
+@functools.cache
+def _workerCpus():
+  '''
+  Return set of logical cpus background workers may run on while the master
+  does simulation work as well: all cpus this process may run on except the 
+  ones of the first physical core, which is left to the master. Returns an
+  empty set if cpu affinities are not supported or no other core is left.
+  '''
+  try:
+    allowed = sorted(os.sched_getaffinity(0))
+  except (AttributeError, OSError):
+    return set()
+  cores = _cpuCores()
+  masterCore = cores.get(allowed[0], allowed[0])
+  return {cpu for cpu in allowed if cores.get(cpu, cpu) != masterCore}
+
+
 def setupRandomSeed():
   # setup random seeds for numpy's and python's random module to something
   # that will differs between processes and threads for good Monte-Carlo
-  # performance
+  # performance, prefer kernel entropy because workers launched within the
+  # same instant could end up with the same pid/time/thread id based seed
   import random
   import numpy.random
-  random.seed(int(abs(os.getpid()*(time.time()%1)*threading.get_ident()+1000) % 2**32))
-  numpy.random.seed(int(abs(os.getpid()*(time.time()%1)*threading.get_ident()+1000) % 2**32))
+  try:
+    seeds = os.urandom(8)
+    random.seed(int.from_bytes(seeds[:4], 'little'))
+    numpy.random.seed(int.from_bytes(seeds[4:], 'little'))
+  except NotImplementedError:
+    random.seed(int(abs(os.getpid()*(time.time()%1)*threading.get_ident()+1000) % 2**32))
+    numpy.random.seed(int(abs(os.getpid()*(time.time()%1)*threading.get_ident()+1000) % 2**32))
@@ -13,12 +13,22 @@ import subprocess
 import os
 import sys
 import signal
+import time
+import tempfile
 
 from ... import io
 from .. import results_store
 from .. import processes
 
 _WORKER_INDEX = 0
+_POLL_INTERVAL = 5e-2
+
+# every worker occupies one core already, keep numpy/BLAS from starting a
+# thread pool per worker on top of that
+_WORKER_ENV_OVERRIDES = {'OMP_NUM_THREADS': '1', 
+                         'MKL_NUM_THREADS': '1',
+                         'OPENBLAS_NUM_THREADS': '1', 
+                         'NUMEXPR_NUM_THREADS': '1'}
 
 class WorkerProcess:
   '''
@@ -38,6 +48,7 @@ class WorkerProcess:
     self.simulationFilePath = os.path.realpath(processes.simulatingDocument().getFileName())
     self.simulationRunFolder = simulationRunFolder
     self._isRunning = True
+    self._lastPoll = -_POLL_INTERVAL
 
     # try to extract freecad executable path: first check APPIMAGE evironment variable,
     # to find out if running appimage, then try executable found in sys.executable,
@@ -50,30 +61,78 @@ class WorkerProcess:
       freecadPath = 'freecad'
     io.verb(f'detected freecad executable "{freecadPath}"')
 
-    # launch child process
-    self._p = subprocess.Popen([freecadPath, '-c', self.simulationFilePath],
-                                stdout=subprocess.DEVNULL,
-                                stderr=subprocess.DEVNULL,
-                                stdin=subprocess.PIPE, 
-                                text=True, bufsize=-1)
+    # create control pipe: the worker polls the read end for quit requests and
+    # sees EOF if this process dies (not available on non-posix platforms)
+    controlFd = None
+    self._controlWriteFd = None
+    if os.name == 'posix':
+      controlFd, self._controlWriteFd = os.pipe()
+
+    # write python snippet that starts the desired simulation mode to a script
+    # file, FreeCAD opens the document and runs the script in the given order,
+    # use the macro suffix because FreeCAD imports .py files as modules (adding
+    # their folder to sys.path) and runs them a second time if the import fails,
+    # the script removes itself right away in case this process dies (the file
+    # is removed by the master once the worker exited if that fails, e.g. on windows)
+    with tempfile.NamedTemporaryFile('w', prefix='optics-design-worker-', 
+                                     suffix='.FCMacro', delete=False) as f:
+      f.write(f'import os\n'
+              f'try:\n'
+              f'  os.remove({f.name!r})\n'
+              f'except OSError:\n'
+              f'  pass\n'
+              f'import freecad.optics_design_workbench.simulation\n'
+              f'freecad.optics_design_workbench.simulation.runSimulation('
+                     f'action="{self.simulationType}", '
+                     f'slaveInfo=dict(simulationRunFolder="{self.simulationRunFolder}", '
+                     f'               parentPid={os.getpid()}, '
+                     f'               controlFd={controlFd}))\n'
+              f'exit()\n')
+    self._scriptPath = f.name
 
-    # write python snippet to start desired simulation mode
+    # launch child process
     self.say('entering simulation loop...')
-    self.write(f'\r\n'
-               f'import freecad.optics_design_workbench.simulation\r\n'
-               f'freecad.optics_design_workbench.simulation.runSimulation('
-                      f'action="{self.simulationType}", '
-                      f'slaveInfo=dict(simulationRunFolder="{self.simulationRunFolder}", '
-                      f'               parentPid={os.getpid()}))\r\n'
-               f'exit()\r\n')
+    try:
+      self._p = subprocess.Popen([freecadPath, '-c', self.simulationFilePath, self._scriptPath],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL,
+                                  stdin=subprocess.DEVNULL,
+                                  env={**os.environ, **_WORKER_ENV_OVERRIDES},
+                                  pass_fds=(controlFd,) if controlFd is not None else (),
+                                  start_new_session=(os.name == 'posix'))
+
+    # no child to hand the pipe and script over to, e.g. freecad executable not found
+    except Exception:
+      if controlFd is not None:
+        os.close(controlFd)
+      self._closeControlPipe()
+      self._removeScript()
+      raise
+
+    # read end is owned by the child from now on
+    if controlFd is not None:
+      os.close(controlFd)
+
+    # pidfd becomes readable when the child exits, which allows waiting for
+    # workers with select instead of polling (linux only)
+    self.pidfd = None
+    if hasattr(os, 'pidfd_open'):
+      try:
+        self.pidfd = os.pidfd_open(self._p.pid)
+      except OSError:
+        pass
 
     self._isquit = False
     self._isterminate = False
     self._iskill = False
 
-  def write(self, data):
-    self._p.stdin.write(data)
-    self._p.stdin.flush()
+  def setCpuAffinity(self, cpus):
+    try:
+      os.sched_setaffinity(self._p.pid, cpus)
+    except (AttributeError, OSError):
+      pass
+    else:
+      io.verb(f'worker ({self.index}) restricted to cpu(s) {", ".join([str(c) for c in sorted(cpus)])}')
 
   def say(self, msg):
     if type(msg) is not str:
@@ -83,8 +142,45 @@ class WorkerProcess:
       if len(line):
         io.info(f'worker ({self.index}) says: '+line)
 
-  def isRunning(self):
-    if self._isRunning:
+  def _closeControlPipe(self):
+    if self._controlWriteFd is not None:
+      try:
+        os.close(self._controlWriteFd)
+      except OSError:
+        pass
+      self._controlWriteFd = None
+
+  def _removeScript(self):
+    if self._scriptPath is not None:
+      try:
+        os.remove(self._scriptPath)
+      except OSError:
+        pass
+      self._scriptPath = None
+
+  def _closePidfd(self):
+    if self.pidfd is not None:
+      try:
+        os.close(self.pidfd)
+      except OSError:
+        pass
+      self.pidfd = None
+
+  def release(self):
+    # close pipe and pidfd of an exited worker, only the master's main thread
+    # may do this because it is the one writing to the pipe and waiting on
+    # the pidfd, isRunning may be called from any thread
+    self._closeControlPipe()
+    self._closePidfd()
+    self._removeScript()
+
+  def isRunning(self, maxAge=None):
+    # quit/terminate/kill and the wait loops ask repeatedly, only poll the child
+    # again if the last result is older than maxAge seconds (default 50ms)
+    if maxAge is None:
+      maxAge = _POLL_INTERVAL
+    if self._isRunning and time.monotonic()-self._lastPoll >= maxAge:
+      self._lastPoll = time.monotonic()
       if (res:=self._p.poll()) is not None:
         self._isRunning = False
         self.say(f'finished (exit code {res})')
@@ -94,21 +190,32 @@ class WorkerProcess:
     if self.isRunning() and not self._isquit:
       self.say('asking FreeCAD to quit...')
       self._isquit = True
-
-  def terminate(self):
-    if self.isRunning():
-      if not self._isterminate:
-        self.say('terminating FreeCAD...')
-        self._isterminate = True
+      if self._controlWriteFd is not None:
+        try:
+          os.write(self._controlWriteFd, b'q')
+        except OSError:
+          pass
+
+  def _sendSignal(self, sig):
+    # worker runs in its own session, signal the whole process group to make
+    # sure helper processes FreeCAD may have spawned are hit as well
+    if os.name == 'posix':
       try:
-        self._p.stdin.close()
-      except:
+        os.killpg(os.getpgid(self._p.pid), sig)
+      except ProcessLookupError:
         pass
-      self._p.send_signal(signal.SIGTERM)
+    else:
+      self._p.send_signal(sig)
+
+  def terminate(self):
+    # signals are delivered reliably, send them only once
+    if self.isRunning() and not self._isterminate:
+      self.say('terminating FreeCAD...')
+      self._isterminate = True
+      self._sendSignal(signal.SIGTERM)
 
   def kill(self):
-    if self.isRunning():
-      if not self._iskill:
-        self.say('killing FreeCAD...')
-        self._iskill = True
-      self._p.send_signal(signal.SIGKILL)
+    if self.isRunning() and not self._iskill:
+      self.say('killing FreeCAD...')
+      self._iskill = True
+      self._sendSignal(signal.SIGKILL)
@@ -10,18 +10,23 @@ try:
 except ImportError:
   pass
 
-from numpy import *
+from numpy import empty, inf, random
 import os
 import time
 import pickle
 import functools
 import threading
-from atomicwrites import atomic_write
+import queue
 
 from .. import freecad_elements
 from .. import io
 from . import processes
 
+# protocol 5 copies numpy array data into the pickle straight from the array
+# buffer instead of going through a bytes object, files remain loadable with
+# pickle.load
+_PICKLE_PROTOCOL = 5
+
 def getResultsFolderPath():
   base, fname, folderName = _getFolderBase()
   return f'{base}/{folderName}'
@@ -68,6 +73,9 @@ def _getFolderBase():
 
 
 class SimulationResultsSingleRay:
+  # one instance is created per traced ray, slots keep them small
+  __slots__ = ('source', 'isComplete', 'segments')
+
   def __init__(self, source):
     self.source = source
     self.isComplete = False
@@ -81,12 +89,15 @@ class SimulationResultsSingleRay:
       raise RuntimeError('trying to dump incomplete ray, this is not a good idea')
 
     if len(self.segments):
-      # generate array of all point coordinates by taking all segment start
-      # points and append the end point of the last segment
-      pointArray = array([list(p) for (p,_), _, _ in self.segments]
-                                                  + [self.segments[-1][0][1]])
-      # generate array of all powers in segments
-      powerArray = array([power for _,power,_ in self.segments])                                                  
+      # fill preallocated arrays with all segment start points plus the end
+      # point of the last segment and with the powers of all segments 
+      n = len(self.segments)
+      pointArray = empty((n+1, 3))
+      powerArray = empty(n)
+      for i, ((p,_), power, _) in enumerate(self.segments):
+        pointArray[i] = list(p)
+        powerArray[i] = power
+      pointArray[n] = list(self.segments[-1][0][1])
       # generate string list of all media traversed by segments
       mediaList = [medium.Name if medium is not None else None for _,_,medium in self.segments]
       # return result dict
@@ -98,6 +109,45 @@ class SimulationResultsSingleRay:
     self.isComplete = True
 
 
+class SimulationResultsHitBuffer:
+  '''
+  Collects the ray hits written to one results file (one source/object label
+  pair) in numpy arrays that double their capacity when full, such that no
+  per-hit python objects need to be kept until the next flush.
+  '''
+  def __init__(self, source, obj, capacity=1024):
+    self.source = source
+    self.obj = obj
+    self.count = 0
+    self.points = empty((capacity, 3))
+    self.directions = empty((capacity, 3))
+    self.powers = empty(capacity)
+    self.isEntering = empty(capacity, dtype=int)
+
+  def addHit(self, point, direction, power, isEntering):
+    if self.count == len(self.powers):
+      self._grow()
+    self.points[self.count] = list(point)
+    self.directions[self.count] = list(direction)
+    self.powers[self.count] = power
+    self.isEntering[self.count] = int(isEntering)
+    self.count += 1
+
+  def _grow(self):
+    for k in 'points directions powers isEntering'.split():
+      old = getattr(self, k)
+      new = empty((2*len(old),)+old.shape[1:], dtype=old.dtype)
+      new[:len(old)] = old
+      setattr(self, k, new)
+
+  def dump(self):
+    return dict(source=self.source.Name, obj=self.obj.Name,
+                points=self.points[:self.count], 
+                directions=self.directions[:self.count],
+                powers=self.powers[:self.count], 
+                isEntering=self.isEntering[:self.count])
+
+
 class SimulationResults:
   def __init__(self, simulationType, simulationRunFolder, flushEverySeconds=5, 
                dumpProgressEverySeconds=.2,
@@ -107,9 +157,13 @@ class SimulationResults:
     self.flushEverySeconds = flushEverySeconds
     self.dumpProgressEverySeconds = dumpProgressEverySeconds
 
+    # separate generator for timing jitter and file names, drawing from numpy's
+    # global generator would shift the random numbers used for ray tracing
+    self._rng = random.default_rng()
+
     # randomize start times to prevent synchronization of worker dumps
-    self._lastFlush = time.time()+self.flushEverySeconds*random.random()
-    self._lastDumpedProgress = time.time()+self.dumpProgressEverySeconds*random.random()
+    self._lastFlush = time.time()+self.flushEverySeconds*self._rng.random()
+    self._lastDumpedProgress = time.time()+self.dumpProgressEverySeconds*self._rng.random()
     self._latestProgressUpdate = time.time()
     self._lastMsg = time.time()
     self.t0 = time.time()
@@ -148,10 +202,23 @@ class SimulationResults:
     self.totalRecordedHits = 0
     self.progressByWorker = {}
 
+    # summed progress of all workers and when it was last read from disk
+    self._progress = None
+    self._lastProgressRead = -inf
+
     # prepare lists to store results
     self.rays = None
     self.hits = None
 
+    # folders created by _makeFilename so far
+    self._createdFolders = set()
+
+    # background thread writing flushed results to disk, started on first use
+    # and stopped again by every waiting flush
+    self._writeQueue = None
+    self._writerThread = None
+    self._writeError = None
+
   def incrementRayCount(self):
     self.totalTracedRays += 1
 
@@ -175,108 +242,168 @@ class SimulationResults:
     # generate filename from fingerprint, timestamp and kind
     fname = f'{self._fingerprint()}-{kind}.pkl'
 
-    # make sure path exists and return
-    os.makedirs(f'{self.basePath}/{folderName}', exist_ok=True)
+    # make sure path exists (only once per folder, this is called for every
+    # progress dump and every flushed group) and return
+    if folderName not in self._createdFolders:
+      os.makedirs(f'{self.basePath}/{folderName}', exist_ok=True)
+      self._createdFolders.add(folderName)
     return f'{self.basePath}/{folderName}/{fname}'
 
-  def flush(self):
+  def _writeFile(self, path, data):
     '''
-    flush buffered data to disk and clear results lists
+    hand serialized data over to the background writer thread, blocks only
+    if the writer falls behind by more than a few files
+    '''
+    self._raiseWriteError()
+    if self._writeQueue is None:
+      self._writeQueue = queue.Queue(maxsize=32)
+      self._writerThread = threading.Thread(target=self._writerLoop, args=(self._writeQueue,))
+      self._writerThread.start()
+    self._writeQueue.put((path, data))
+
+  def _writerLoop(self, writeQueue):
+    # waitForWrites puts None on the queue to end the thread
+    while (item := writeQueue.get()) is not None:
+      path, data = item
+      try:
+        with open(path, 'wb') as f:
+          f.write(data)
+      except Exception as e:
+        self._writeError = e
+
+  def _raiseWriteError(self):
+    # report a failed background write once
+    if self._writeError:
+      err, self._writeError = self._writeError, None
+      raise err
+
+  def _stopWriter(self):
+    if self._writeQueue is not None:
+      self._writeQueue.put(None)
+      self._writerThread.join()
+      self._writeQueue = None
+      self._writerThread = None
+
+  def waitForWrites(self):
+    '''
+    block until all flushed data is written to disk and stop the writer
+    thread, the next flush starts a new one
+    '''
+    self._stopWriter()
+    self._raiseWriteError()
+
+  def flush(self, wait=True):
+    '''
+    flush buffered data to disk and clear results lists, data is serialized
+    right away but written by a background thread, wait=True blocks until
+    everything is on disk
     '''
     # reset fingerprint cache to make sure a fresh one is generated
     self._fingerprint.cache_clear()
 
-    # handle ray data
-    if self.rays is not None:
-      # assemble dictionaries to dump
-      results = {}
-
-      # dump complete rays and store incomplete in separate list
-      incomplete = []
-      dump = []
-      for r in self.rays:
-        if r.isComplete:
-          fname = self._makeFilename(kind='rays', source=r.source)
-          if fname not in results.keys():
-            results[fname] = []
-          results[fname].append(r.dump())
-        else:
-          incomplete.append(r)
-
-      # write result data
-      for fname, dump in results.items():
-        with open(fname, 'wb') as f:
-          pickle.dump(dump, f)
+    # the writer thread is stopped by waiting flushes even if serializing fails,
+    # otherwise it would keep this object alive and block the interpreter exit,
+    # a pending write error must not replace the exception in flight though
+    try:
+      # handle ray data
+      if self.rays is not None:
+        # assemble dictionaries to dump
+        results = {}
+
+        # dump complete rays and store incomplete in separate list
+        incomplete = []
+        dump = []
+        for r in self.rays:
+          if r.isComplete:
+            fname = self._makeFilename(kind='rays', source=r.source)
+            if fname not in results.keys():
+              results[fname] = []
+            results[fname].append(r.dump())
+          else:
+            incomplete.append(r)
+
+        # write result data
+        for fname, dump in results.items():
+          self._writeFile(fname, pickle.dumps(dump, protocol=_PICKLE_PROTOCOL))
         
-      # replace internal ray list with incomplete list
-      self.totalRecordedRays += len(self.rays or [])-len(incomplete or [])
-      self.rays = incomplete if len(incomplete) else None
-
-    # handle hit data
-    if self.hits is not None:
-      # assemble dictionaries to dump
-      results = {}
-      for source, obj, p, d, power, isEntering in self.hits:
-        # create entry in results dict if needed
-        fname = self._makeFilename(kind='hits', source=source, obj=obj)
-        if fname not in results.keys():
-          results[fname] = dict(source=source.Name, obj=obj.Name,
-                                points=[], directions=[], 
-                                powers=[], isEntering=[])
-
-        # append data to entry
-        results[fname]['points'].append(list(p))
-        results[fname]['directions'].append(list(d))
-        results[fname]['powers'].append(power)
-        results[fname]['isEntering'].append(int(isEntering))
-
-      # loop through create fnames, convert to numpy arrays and dump
-      for fname, res in results.items():
-        with open(fname, 'wb') as f:
-          for k in 'points directions powers isEntering'.split():
-            res[k] = array(res[k]) 
-          pickle.dump(res, f)
-
-      # clear list
-      self.totalRecordedHits += len(self.hits or [])
-      self.hits = None
-
-    # update last flush timestamp, add 10%ish random jitter to prevent synchronization of worker dumps
-    self._lastFlush = time.time() + (.1*random.random()-.05)*self.flushEverySeconds
+        # replace internal ray list with incomplete list
+        self.totalRecordedRays += len(self.rays or [])-len(incomplete or [])
+        self.rays = incomplete if len(incomplete) else None
+
+      # handle hit data
+      if self.hits is not None:
+        # dump one file per source/object pair
+        for buffer in self.hits.values():
+          self._writeFile(self._makeFilename(kind='hits', source=buffer.source, obj=buffer.obj),
+                          pickle.dumps(buffer.dump(), protocol=_PICKLE_PROTOCOL))
+
+        # clear buffers
+        self.totalRecordedHits += self._bufferedHitCount()
+        self.hits = None
+
+      # update last flush timestamp, add 10%ish random jitter to prevent synchronization of worker dumps
+      self._lastFlush = time.time() + (.1*self._rng.random()-.05)*self.flushEverySeconds
+    except BaseException:
+      if wait:
+        self._stopWriter()
+      raise
+    if wait:
+      self.waitForWrites()
+
+  def _bufferedHitCount(self):
+    return sum([b.count for b in (self.hits or {}).values()])
 
   def dumpProgress(self):
     '''
-    dump pickled summary of simulation progress (use atomic_write)
+    dump pickled summary of simulation progress, the data is written to a
+    temporary file in the same folder and renamed afterwards such that the
+    reader never sees partial files (the temporary name does not match the
+    progress file pattern and is ignored by the reader)
     '''
-    with atomic_write(self._makeFilename(source='progress', kind=str(hex(int(random.random()*1e15)))[2:]), 
-                      mode='wb', overwrite=True) as f:
-      pickle.dump(dict(totalIterations = self.totalIterations,
-                       totalTracedRays = self.totalTracedRays,
-                       totalRecordedHits = self.totalRecordedHits+len(self.hits or []),
-                       totalRecordedRays = self.totalRecordedRays+len(self.rays or [])), f)
+    data = pickle.dumps(dict(totalIterations = self.totalIterations,
+                             totalTracedRays = self.totalTracedRays,
+                             totalRecordedHits = self.totalRecordedHits+self._bufferedHitCount(),
+                             totalRecordedRays = self.totalRecordedRays+len(self.rays or [])),
+                        protocol=_PICKLE_PROTOCOL)
+    path = self._makeFilename(source='progress', kind=str(hex(int(self._rng.random()*1e15)))[2:])
+    tmpPath = f'{os.path.dirname(path)}/.tmp-{os.path.basename(path)}'
+    with open(tmpPath, 'wb') as f:
+      f.write(data)
+    os.replace(tmpPath, path)
 
     # update last dump timestamp, add 100% random jitter to prevent synchronization of worker dumps
-    self._lastDumpedProgress = time.time() + (2*random.random()-1)*self.dumpProgressEverySeconds
+    self._lastDumpedProgress = time.time() + (2*self._rng.random()-1)*self.dumpProgressEverySeconds
     self._latestProgressUpdate = time.time()
 
   @functools.cache
   def progressMonitorPath(self):
     return os.path.dirname(self._makeFilename(source='progress', kind='none'))
 
-  def getProgress(self, _neverReport=False):
-    result = {}
-    for _, prog in self.getProgressByWorker().items():
-      for k, v in prog.items():
-        if k not in result:
-          result[k] = 0
-        result[k] += v
-
-    # check whether simulation is done and call cancelSimulation if so
-    if (result.get('totalIterations', 0) > self.endAfterIterations
-            or result.get('totalTracedRays', 0) > self.endAfterRays
-            or result.get('totalRecordedHits', 0) > self.endAfterHits):
-      self.reachedEnd = True
-      processes.setIsFinished(True)
+  def getProgress(self, maxAge=None, _neverReport=False):
+    # progress files change only every dumpProgressEverySeconds, reading them 
+    # more often (the progress window asks every 50ms, the mainloop and the
+    # performance report as well) would just repeat the directory scan, reuse
+    # results younger than maxAge seconds (defaults to the dump interval)
+    if maxAge is None:
+      maxAge = self.dumpProgressEverySeconds
+    if self._progress is None or time.monotonic()-self._lastProgressRead >= maxAge:
+      self._lastProgressRead = time.monotonic()
+      result = {}
+      for _, prog in self.getProgressByWorker().items():
+        for k, v in prog.items():
+          if k not in result:
+            result[k] = 0
+          result[k] += v
+      self._progress = result
+
+      # check whether simulation is done and set finished flag if so (only once,
+      # a later cancel must not be overwritten)
+      if not self.reachedEnd and (result.get('totalIterations', 0) > self.endAfterIterations
+              or result.get('totalTracedRays', 0) > self.endAfterRays
+              or result.get('totalRecordedHits', 0) > self.endAfterHits):
+        self.reachedEnd = True
+        processes.setIsFinished(True)
+    result = self._progress
 
     # report progress to shell from time to time
     if time.time() - self._lastMsg > 5 and not _neverReport:
@@ -288,9 +415,9 @@ class SimulationResults:
 
     return result
 
-  def performanceDescription(self):
+  def performanceDescription(self, maxAge=None):
     # disable reporting to prevent endless recursion
-    p = self.getProgress(_neverReport=True)
+    p = self.getProgress(maxAge=maxAge, _neverReport=True)
     return (f'{60*60*p.get("totalTracedRays", 0)/(time.time()-self.t0):.1e} rays/hour, '
             f'{60*60*p.get("totalRecordedHits", 0)/(time.time()-self.t0):.1e} recorded hits/hour')
 
@@ -307,6 +434,14 @@ class SimulationResults:
       except Exception:
         pass
       else:
+        # files written before this results object existed are leftovers of
+        # some earlier run, remove them without loading
+        if not timestamp.isnumeric() or int(timestamp) < int(self.t0*1e3):
+          try:
+            os.remove(monitorPath+'/'+f)
+          except FileNotFoundError:
+            pass
+          continue
         key = pid
         if key not in byWorker.keys():
           byWorker[key] = []
@@ -335,19 +470,27 @@ class SimulationResults:
 
         # delete all files
         for f in files:
-          os.remove(monitorPath+'/'+f[1])
+          try:
+            os.remove(monitorPath+'/'+f[1])
+          except OSError:
+            # may fail on windows while the file is still open, retry next time
+            pass
 
         # note current time as latest update
         self._latestProgressUpdate = time.time()
     return self.progressByWorker
 
   def writeDiskIfNeeded(self):
+    # this is called for every ray and hit, keep the common case of nothing
+    # to do down to a single clock read
+    now = time.time()
+
     # check if it is time to flush to disk
-    if time.time()-self._lastFlush > self.flushEverySeconds:
-      self.flush()
+    if now-self._lastFlush > self.flushEverySeconds:
+      self.flush(wait=False)
 
     # check if it is time to dump progress
-    if time.time()-self._lastDumpedProgress > self.dumpProgressEverySeconds:
+    if now-self._lastDumpedProgress > self.dumpProgressEverySeconds:
       self.dumpProgress()
 
   def isSimulationRunning(self):
@@ -367,7 +510,13 @@ class SimulationResults:
     return ray
 
   def addRayHit(self, source, obj, point, direction, power, isEntering):
+    # hits are buffered per output file, which is named after the labels of
+    # source and object, key by labels because FreeCAD may hand out different 
+    # python wrappers for the same object and distinct objects may share labels
     if self.hits is None:
-      self.hits = []
-    self.hits.append([source, obj, point, direction, power, isEntering])
+      self.hits = {}
+    key = (source.Label, obj.Label)
+    if (buffer := self.hits.get(key)) is None:
+      buffer = self.hits[key] = SimulationResultsHitBuffer(source, obj)
+    buffer.addHit(point, direction, power, isEntering)
     self.writeDiskIfNeeded()